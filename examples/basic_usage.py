@@ -2,7 +2,7 @@
 Basic usage examples for the toksum library.
 """
 
-from toksum import TokenCounter, count_tokens, get_supported_models, estimate_cost, SmartChunker
+from toksum import TokenCounter, count_tokens, get_encoding_name, get_supported_models, estimate_cost, estimate_cost_batch, SmartChunker
 
 def main():
     print("=== toksum Library Examples ===\n")
@@ -66,9 +66,15 @@ def main():
     print(f"Sample text length: {len(sample_text)} characters")
     print("\nToken counts and estimated costs:")
     
+    # Models that share an encoding give the same count, so tokenize once per encoding
+    tokens_by_encoding = {}
+    
     for model in models_to_test:
         try:
-            tokens = count_tokens(sample_text, model)
+            encoding = get_encoding_name(model)
+            if encoding not in tokens_by_encoding:
+                tokens_by_encoding[encoding] = count_tokens(sample_text, model)
+            tokens = tokens_by_encoding[encoding]
             input_cost = estimate_cost(tokens, model, input_tokens=True)
             output_cost = estimate_cost(tokens, model, input_tokens=False)
             
@@ -78,6 +84,13 @@ def main():
             print(f"  Output cost: ${output_cost:.4f}")
         except Exception as e:
             print(f"{model}: Error - {e}")
+    
+    # Price a whole batch of documents per model in one call
+    document_tokens = [250, 1_000, 12_500, 80_000]
+    print(f"\nInput cost for documents of {document_tokens} tokens:")
+    for model in models_to_test:
+        costs = estimate_cost_batch(document_tokens, model, input_tokens=True)
+        print(f"  {model}: total ${sum(costs):.4f}")
     print()
     
     # Example 5: List supported models
@@ -0,0 +1,17 @@
+"""
+Shared pytest fixtures for the toksum test suite.
+"""
+
+import pytest
+
+from toksum import core
+
+
+@pytest.fixture(autouse=True)
+def clear_counter_cache():
+    """Drop cached counters and counts so patched tokenizers never leak between tests."""
+    core._get_counter.cache_clear()
+    core._count_cached.cache_clear()
+    yield
+    core._get_counter.cache_clear()
+    core._count_cached.cache_clear()
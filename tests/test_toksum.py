@@ -2,10 +2,12 @@
 Tests for the toksum library.
 """
 
+import re
+import warnings
 import pytest
 from unittest.mock import Mock, patch
 
-from toksum import TokenCounter, count_tokens, get_supported_models, SmartChunker
+from toksum import TokenCounter, count_tokens, count_tokens_batch, get_encoding_name, get_supported_models, SmartChunker
 from typing import List
 from toksum.exceptions import UnsupportedModelError, TokenizationError
 
@@ -137,7 +139,115 @@ class TestConvenienceFunctions:
         
         result = count_tokens("Hello", "gpt-4")
         assert result == 3
-    
+
+    @patch('toksum.core.tiktoken')
+    def test_count_tokens_reuses_counter(self, mock_tiktoken):
+        """Test that repeated calls for one model load the tokenizer once."""
+        mock_encoder = Mock()
+        mock_encoder.encode.return_value = [1, 2, 3]
+        mock_tiktoken.get_encoding.return_value = mock_encoder
+
+        for _ in range(5):
+            assert count_tokens("Hello", "gpt-4") == 3
+        assert mock_tiktoken.get_encoding.call_count == 1
+
+    @patch('toksum.core.tiktoken')
+    def test_count_tokens_caches_repeated_text(self, mock_tiktoken):
+        """Test that counting the same text again does not tokenize it again."""
+        mock_encoder = Mock()
+        mock_encoder.encode.side_effect = lambda text: [1] * len(text.split())
+        mock_tiktoken.get_encoding.return_value = mock_encoder
+
+        assert count_tokens("one two three", "gpt-4") == 3
+        assert count_tokens("one two three", "gpt-4") == 3
+        assert count_tokens("one two", "gpt-4") == 2
+        assert mock_encoder.encode.call_count == 2
+
+    @patch('toksum.core.tiktoken')
+    def test_count_tokens_does_not_cache_long_text(self, mock_tiktoken):
+        """Test that texts over the cache length limit are tokenized every time."""
+        mock_encoder = Mock()
+        mock_encoder.encode.side_effect = lambda text: [1] * len(text.split())
+        mock_tiktoken.get_encoding.return_value = mock_encoder
+
+        long_text = "word " * 1000
+        assert count_tokens(long_text, "gpt-4") == 1000
+        assert count_tokens(long_text, "gpt-4") == 1000
+        assert mock_encoder.encode.call_count == 2
+
+    def test_count_tokens_invalid_input_not_cached(self):
+        """Test that unhashable input still raises TokenizationError."""
+        with pytest.raises(TokenizationError):
+            count_tokens(["not", "a", "string"], "claude-3-opus-20240229")
+
+    @patch('toksum.core.tiktoken')
+    def test_count_tokens_batch_function(self, mock_tiktoken):
+        """Test the count_tokens_batch convenience function."""
+        mock_encoder = Mock()
+        mock_encoder.encode.side_effect = lambda text: [1] * len(text.split())
+        mock_tiktoken.get_encoding.return_value = mock_encoder
+
+        result = count_tokens_batch(["Hi", "Hello there", ""], "gpt-4")
+        assert result == [1, 2, 0]
+        mock_encoder.encode_batch.assert_not_called()  # Too small for threads
+
+    @patch('toksum.core.os.cpu_count', return_value=4)
+    @patch('toksum.core.tiktoken')
+    def test_count_tokens_batch_large_uses_threads(self, mock_tiktoken, mock_cpu_count):
+        """Test that large batches go through tiktoken's threaded batch encoder."""
+        texts = [f"text number {i}" for i in range(100)]
+        mock_encoder = Mock()
+        mock_encoder.encode_batch.side_effect = lambda batch, num_threads: [[1, 2, 3] for _ in batch]
+        mock_tiktoken.get_encoding.return_value = mock_encoder
+
+        assert count_tokens_batch(texts, "gpt-4") == [3] * 100
+        mock_encoder.encode_batch.assert_called_once_with(texts, num_threads=4)
+        mock_encoder.encode.assert_not_called()
+
+    def test_count_tokens_batch_approximation(self):
+        """Test batch counting matches single counting for approximated models."""
+        texts = ["Hello, world!", "This is a test", ""]
+        model = "claude-3-opus-20240229"
+
+        assert count_tokens_batch(texts, model) == [count_tokens(t, model) for t in texts]
+
+    @patch('toksum.core.tiktoken')
+    def test_count_tokens_batch_counts_duplicates_once(self, mock_tiktoken):
+        """Test that repeated texts in a batch are only encoded once."""
+        mock_encoder = Mock()
+        mock_encoder.encode.side_effect = lambda text: [1] * len(text.split())
+        mock_tiktoken.get_encoding.return_value = mock_encoder
+
+        texts = ["Header", "Body one", "Header", "Body two words", "Header"]
+        assert count_tokens_batch(texts, "gpt-4") == [1, 2, 1, 3, 1]
+        assert mock_encoder.encode.call_count == 3
+
+    def test_count_tokens_batch_invalid_input(self):
+        """Test batch counting rejects invalid input."""
+        with pytest.raises(TokenizationError):
+            count_tokens_batch("not a list", "claude-3-opus-20240229")
+
+        with pytest.raises(TokenizationError):
+            count_tokens_batch(["ok", None], "claude-3-opus-20240229")
+
+    @patch('toksum.core.tiktoken')
+    def test_get_encoding_name(self, mock_tiktoken):
+        """Test encoding names group models that count identically."""
+        mock_tiktoken.get_encoding.return_value = Mock()
+
+        assert get_encoding_name("gpt-4") == "cl100k_base"
+        assert get_encoding_name("gpt-3.5-turbo") == "cl100k_base"
+        assert get_encoding_name("claude-3-opus-20240229") == get_encoding_name("claude-3-haiku-20240307")
+        assert get_encoding_name("claude-3-opus-20240229") != get_encoding_name("gemini-pro")
+
+    def test_import_does_not_load_anthropic_sdk(self):
+        """Test that importing toksum does not pay for the Anthropic SDK import."""
+        import subprocess
+        import sys
+
+        code = "import sys, toksum; sys.exit('anthropic' in sys.modules)"
+        assert subprocess.run([sys.executable, "-c", code]).returncode == 0
+
     def test_get_supported_models(self):
         """Test getting supported models."""
         models = get_supported_models()
@@ -214,6 +324,24 @@ class TestCostEstimation:
         
         cost = estimate_cost(1000, "unknown-model")
         assert cost == 0.0
+    
+    def test_estimate_cost_batch_matches_single(self):
+        """Test batch cost estimation agrees with estimate_cost."""
+        from toksum.core import estimate_cost, estimate_cost_batch
+        
+        token_counts = [0, 1, 999, 1000, 123456]
+        for model in ["gpt-4", "gpt-4o-mini", "claude-3-haiku-20240307"]:
+            for input_tokens in (True, False):
+                for currency in ("USD", "INR"):
+                    costs = estimate_cost_batch(token_counts, model, input_tokens, currency)
+                    expected = [estimate_cost(n, model, input_tokens, currency) for n in token_counts]
+                    assert costs == pytest.approx(expected)
+    
+    def test_estimate_cost_batch_unknown_model(self):
+        """Test batch cost estimation for unknown models."""
+        from toksum.core import estimate_cost_batch
+        
+        assert estimate_cost_batch([10, 20], "unknown-model") == [0.0, 0.0]
 
 
 class TestNewProviders:
@@ -2916,6 +3044,12 @@ class TestNewModelsComprehensive:
 class TestSmartChunker:
     """Test cases for SmartChunker class."""
     
+    @pytest.fixture(autouse=True)
+    def mock_tiktoken(self):
+        """Stub out tiktoken so chunkers for OpenAI models can be built offline."""
+        with patch('toksum.core.tiktoken') as mock_tiktoken:
+            yield mock_tiktoken
+    
     def test_init_valid(self):
         """Test initialization with valid parameters."""
         chunker = SmartChunker("gpt-4", max_tokens=100)
@@ -2926,39 +3060,83 @@ class TestSmartChunker:
         """Test initialization with invalid max_tokens."""
         with pytest.raises(ValueError, match="max_tokens must be positive"):
             SmartChunker("gpt-4", max_tokens=0)
+    
+    def test_init_unsupported_model(self):
+        """Test that an unsupported model fails even before any text is chunked."""
+        with pytest.raises(UnsupportedModelError):
+            SmartChunker("no-such-model", max_tokens=100)
+    
+    def test_short_special_token_text_is_counted(self, mock_tiktoken):
+        """Test that short text spelling out a special token is not passed through."""
+        mock_tiktoken.get_encoding.return_value.encode.side_effect = ValueError("disallowed special token")
+        chunker = SmartChunker("gpt-4", max_tokens=100)
+        with pytest.raises(TokenizationError):
+            chunker.chunk_by_sentences("Stop. <|endoftext|>")
         with pytest.raises(ValueError, match="max_tokens must be positive"):
             SmartChunker("gpt-4", max_tokens=-10)
     
+    @patch('toksum.core.count_tokens_batch')
     @patch('toksum.core.count_tokens')
-    def test_chunk_by_sentences_short_text(self, mock_count_tokens):
+    def test_chunk_by_sentences_short_text(self, mock_count_tokens, mock_count_tokens_batch):
         """Test sentence chunking for short text that fits in one chunk."""
         mock_count_tokens.return_value = 20  # Always under limit
-        chunker = SmartChunker("gpt-4", max_tokens=50)
+        mock_count_tokens_batch.side_effect = lambda texts, model: [8] * len(texts)
+        chunker = SmartChunker("gpt-4", max_tokens=20)
         text = "This is a short text. It fits in one chunk."
         chunks = chunker.chunk_by_sentences(text)
         assert len(chunks) == 1
         assert "This is a short text." in chunks[0]
-        assert mock_count_tokens.call_count > 0  # Multiple calls for incremental checks
+        mock_count_tokens_batch.assert_called_once_with(
+            ["This is a short text.", " It fits in one chunk."], "gpt-4"
+        )
+    
+    @patch('toksum.core.count_tokens_batch')
+    @patch('toksum.core.count_tokens')
+    def test_chunk_by_sentences_short_text_not_tokenized(self, mock_count_tokens, mock_count_tokens_batch):
+        """Test that text with no more bytes than max_tokens is not tokenized."""
+        chunker = SmartChunker("gpt-4", max_tokens=21)
+        assert chunker.chunk_by_sentences("  Short. Text here.  ") == ["Short. Text here."]
+        assert chunker.chunk_by_paragraphs("Café.\n\nNaïve text.") == ["Café.\n\nNaïve text."]
+        mock_count_tokens.assert_not_called()
+        mock_count_tokens_batch.assert_not_called()
+        
+        # Non-ASCII characters take more than one byte each
+        mock_count_tokens_batch.side_effect = lambda texts, model: [1] * len(texts)
+        mock_count_tokens.return_value = 2
+        assert chunker.chunk_by_sentences("Été. Déjà vu. Très.") == ["Été. Déjà vu. Très."]
+        assert mock_count_tokens_batch.call_count == 1
+    
+    @patch('toksum.core.count_tokens_batch')
+    @patch('toksum.core.count_tokens')
+    def test_chunk_by_sentences_short_chunks_not_verified(self, mock_count_tokens, mock_count_tokens_batch):
+        """Test that chunks with no more bytes than max_tokens skip the exact count."""
+        mock_count_tokens_batch.side_effect = lambda texts, model: [3] * len(texts)
+        chunker = SmartChunker("gpt-4", max_tokens=12)
+        text = "A. B. C. D. Eeeeeeeeeeeeeeeeeeeeeeee."
+        assert chunker.chunk_by_sentences(text) == ["A. B. C. D.", "Eeeeeeeeeeeeeeeeeeeeeeee."]
+        mock_count_tokens.assert_not_called()
     
+    @patch('toksum.core.count_tokens_batch')
     @patch('toksum.core.count_tokens')
-    def test_chunk_by_sentences_long_text(self, mock_count_tokens):
+    def test_chunk_by_sentences_keeps_original_spacing(self, mock_count_tokens, mock_count_tokens_batch):
+        """Test that chunks are slices of the input, whitespace included."""
+        mock_count_tokens.return_value = 20
+        mock_count_tokens_batch.side_effect = lambda texts, model: [8] * len(texts)
+        chunker = SmartChunker("gpt-4", max_tokens=50)
+        text = "  First line.\nSecond line!   Third line?  "
+        chunks = chunker.chunk_by_sentences(text)
+        assert chunks == ["First line.\nSecond line!   Third line?"]
+    
+    @patch('toksum.core.count_tokens_batch')
+    @patch('toksum.core.count_tokens')
+    def test_chunk_by_sentences_long_text(self, mock_count_tokens, mock_count_tokens_batch):
         """Test sentence chunking for long text that spans multiple chunks."""
-        calls = [0]
-        def side_effect(text, model):
-            calls[0] += 1
-            if calls[0] == 1:  # First sentence
-                return 10
-            if calls[0] == 2:  # First + second
-                return 25  # Under 50
-            if calls[0] == 3:  # First+second + third
-                return 60  # Over 50
-            if calls[0] == 4:  # Third
-                return 35  # Under
-            if calls[0] == 5:  # Third + fourth
-                return 45  # Under
-            return 10  # Fourth alone
-        
-        mock_count_tokens.side_effect = side_effect
+        sizes = {"Sentence one.": 10, "Sentence two.": 15, "Sentence three.": 35, "Sentence four.": 10}
+        def fake_count(text, model):
+            return sum(n for sentence, n in sizes.items() if sentence in text)
+        
+        mock_count_tokens.side_effect = fake_count
+        mock_count_tokens_batch.side_effect = lambda texts, model: [fake_count(t, model) for t in texts]
         
         chunker = SmartChunker("gpt-4", max_tokens=50)
         text = "Sentence one. Sentence two. Sentence three. Sentence four."
@@ -2966,66 +3144,207 @@ class TestSmartChunker:
         assert len(chunks) == 2  # First two, then third + fourth
         assert "Sentence one. Sentence two." in chunks[0]
         assert "Sentence three. Sentence four." in chunks[1]
-        assert mock_count_tokens.call_count >= 5
+        # Each sentence is tokenized once; only separators and chunks are re-counted
+        assert mock_count_tokens_batch.call_count == 1
+        assert mock_count_tokens.call_count <= 1 + len(chunks)
+    
+    @patch('toksum.core.count_tokens_batch')
+    @patch('toksum.core.count_tokens')
+    def test_chunk_by_sentences_count_fn(self, mock_count_tokens, mock_count_tokens_batch):
+        """Test that an injected count function sees each sentence once plus each chunk."""
+        sizes = {"Sentence one.": 10, "Sentence two.": 15, "Sentence three.": 35, "Sentence four.": 10}
+        count_fn = Mock(side_effect=lambda text, model: sum(n for s, n in sizes.items() if s in text))
+    
+        chunker = SmartChunker("gpt-4", max_tokens=50, _count_fn=count_fn)
+        text = "Sentence one. Sentence two. Sentence three. Sentence four."
+        chunks = chunker.chunk_by_sentences(text)
+        assert chunks == ["Sentence one. Sentence two.", "Sentence three. Sentence four."]
+        assert count_fn.call_count == len(sizes) + len(chunks)
+        mock_count_tokens.assert_not_called()
+        mock_count_tokens_batch.assert_not_called()
+    
+    @patch('toksum.core.count_tokens_batch')
+    @patch('toksum.core.count_tokens')
+    def test_chunk_by_sentences_verifies_estimate(self, mock_count_tokens, mock_count_tokens_batch):
+        """Test that a chunk whose exact count exceeds the estimate is shrunk."""
+        def fake_count(text, model):
+            # Joined text costs more than the sum of its sentences
+            return 10 * len(text.split(". "))
+        
+        mock_count_tokens.side_effect = lambda text, model: 0 if text == " " else fake_count(text, model)
+        mock_count_tokens_batch.side_effect = lambda texts, model: [5] * len(texts)
+        
+        chunker = SmartChunker("gpt-4", max_tokens=20)
+        chunks = chunker.chunk_by_sentences("Sentence one. Sentence two. Sentence three. Sentence four.")
+        assert chunks == ["Sentence one. Sentence two.", "Sentence three. Sentence four."]
+    
+    @patch('toksum.core.count_tokens_batch')
+    @patch('toksum.core.count_tokens')
+    def test_chunk_by_sentences_low_estimate_searches(self, mock_count_tokens, mock_count_tokens_batch):
+        """Test that a far too low estimate is corrected without dropping one piece per count."""
+        mock_count_tokens.side_effect = lambda text, model: 10 * text.count(".")
+        mock_count_tokens_batch.side_effect = lambda texts, model: [1] * len(texts)
+        
+        chunker = SmartChunker("gpt-4", max_tokens=20)
+        text = " ".join(f"Sentence number {i}." for i in range(16))
+        chunks = chunker.chunk_by_sentences(text)
+        assert chunks == [f"Sentence number {i}. Sentence number {i + 1}." for i in range(0, 16, 2)]
+        # Dropping one piece per count would take 64 counts here
+        assert mock_count_tokens.call_count < 50
+    
+    @patch('toksum.core.count_tokens_batch')
+    @patch('toksum.core.count_tokens')
+    def test_chunker_reuses_piece_counts(self, mock_count_tokens, mock_count_tokens_batch):
+        """Test that chunking the same text again does not tokenize it again."""
+        mock_count_tokens.return_value = 5
+        mock_count_tokens_batch.side_effect = lambda texts, model: [5] * len(texts)
+        chunker = SmartChunker("gpt-4", max_tokens=50)
+        text = "First sentence. Second sentence. Second sentence. Third sentence."
+        first = chunker.chunk_by_sentences(text)
+        second = chunker.chunk_by_sentences(text)
+        assert first == second
+        mock_count_tokens_batch.assert_called_once_with(
+            ["First sentence.", " Second sentence.", " Third sentence."], "gpt-4"
+        )
+    
+    @patch('toksum.core.count_tokens_batch')
+    @patch('toksum.core.count_tokens')
+    def test_chunk_by_sentences_fills_chunks(self, mock_count_tokens, mock_count_tokens_batch):
+        """Test that chunks are filled when a space joins the word after it."""
+        def fake_count(text, model):
+            # Like BPE, a space is merged into the word that follows it
+            return len(re.findall(r" ?\w+| ?[^\w\s]+|\s+", text))
+        mock_count_tokens.side_effect = fake_count
+        mock_count_tokens_batch.side_effect = lambda texts, model: [fake_count(t, model) for t in texts]
+        chunker = SmartChunker("gpt-4", max_tokens=9)
+        text = " ".join(["Aa bb."] * 6)
+        assert fake_count(text, "gpt-4") == 18
+        assert chunker.chunk_by_sentences(text) == ["Aa bb. Aa bb. Aa bb."] * 2
+    
+    @patch('toksum.core._CACHE_MAX_CHARS', 20)
+    @patch('toksum.core._CHUNKER_CACHE_SIZE', 3)
+    @patch('toksum.core.count_tokens_batch')
+    @patch('toksum.core.count_tokens')
+    def test_chunker_piece_cache_is_bounded(self, mock_count_tokens, mock_count_tokens_batch):
+        """Test that the piece cache keeps neither too many nor too long pieces."""
+        mock_count_tokens.return_value = 5
+        mock_count_tokens_batch.side_effect = lambda texts, model: [5] * len(texts)
+        chunker = SmartChunker("gpt-4", max_tokens=8)
+        text = "One. Two. Three. Four. Five. Six. This one is far too long to cache."
+        chunks = chunker.chunk_by_sentences(text)
+        assert len(chunks) == 7
+        assert len(chunker._token_cache) <= 3
+        assert all(len(piece) <= 20 for piece in chunker._token_cache)
+    
+    def test_chunk_by_sentences_boundaries(self):
+        """Test that sentences only end at punctuation followed by whitespace."""
+        chunker = SmartChunker("claude-3-opus-20240229", max_tokens=1)
+        chunks = chunker.chunk_by_sentences("Pi is 3.14 exactly. Really?!  Yes...\nNo")
+        assert chunks == ["Pi is 3.14 exactly.", "Really?!", "Yes...", "No"]
     
+    @patch('toksum.core.count_tokens_batch')
     @patch('toksum.core.count_tokens')
-    def test_chunk_by_sentences_empty_text(self, mock_count_tokens):
+    def test_chunk_by_sentences_empty_text(self, mock_count_tokens, mock_count_tokens_batch):
         """Test sentence chunking for empty text."""
         chunker = SmartChunker("gpt-4", max_tokens=50)
         chunks = chunker.chunk_by_sentences("")
         assert chunks == []
         mock_count_tokens.assert_not_called()
+        mock_count_tokens_batch.assert_not_called()
     
+    @patch('toksum.core.count_tokens_batch')
+    @patch('toksum.core.count_tokens')
+    def test_iter_chunks_by_sentences_is_lazy(self, mock_count_tokens, mock_count_tokens_batch):
+        """Test that streaming chunks only verifies the chunks asked for."""
+        mock_count_tokens.return_value = 5
+        mock_count_tokens_batch.side_effect = lambda texts, model: [5] * len(texts)
+        chunker = SmartChunker("gpt-4", max_tokens=5)
+        text = "One. Two. Three. Four."
+        chunks = chunker.iter_chunks_by_sentences(text)
+        mock_count_tokens_batch.assert_not_called()
+        assert next(chunks) == "One."
+        assert mock_count_tokens.call_count == 0
+        assert list(chunks) == ["Two.", "Three.", "Four."]
+        assert chunker.chunk_by_sentences(text) == ["One.", "Two.", "Three.", "Four."]
+    
+    @patch('toksum.core.count_tokens_batch')
     @patch('toksum.core.count_tokens')
-    def test_chunk_by_paragraphs_short_text(self, mock_count_tokens):
+    def test_chunk_by_paragraphs_short_text(self, mock_count_tokens, mock_count_tokens_batch):
         """Test paragraph chunking for short text."""
         mock_count_tokens.return_value = 30
-        chunker = SmartChunker("gpt-4", max_tokens=50)
+        mock_count_tokens_batch.side_effect = lambda texts, model: [10] * len(texts)
+        chunker = SmartChunker("gpt-4", max_tokens=30)
         text = "First paragraph.\n\nSecond paragraph."
         chunks = chunker.chunk_by_paragraphs(text)
         assert len(chunks) == 1  # Combined since under limit
         assert "\n\n" in chunks[0]
-        assert mock_count_tokens.call_count > 0
+        assert mock_count_tokens_batch.call_count == 1
     
+    @patch('toksum.core.count_tokens_batch')
     @patch('toksum.core.count_tokens')
-    def test_chunk_by_paragraphs_long_text(self, mock_count_tokens):
+    def test_chunk_by_paragraphs_long_text(self, mock_count_tokens, mock_count_tokens_batch):
         """Test paragraph chunking for text exceeding limit."""
-        calls = [0]
-        def side_effect(text, model):
-            calls[0] += 1
-            if calls[0] == 1:  # First para
-                return 25
-            if calls[0] == 2:  # First + second
-                return 45  # Under
-            if calls[0] == 3:  # First+second + third
-                return 80  # Over
-            if calls[0] == 4:  # Third
-                return 35  # Under
-            if calls[0] == 5:  # Third + fourth
-                return 55  # Over
-            return 20  # Fourth
-        
-        mock_count_tokens.side_effect = side_effect
+        sizes = {"Para1": 25, "Para2": 19, "Para3": 35, "Para4": 20}
+        def fake_count(text, model):
+            return sum(n for paragraph, n in sizes.items() if paragraph in text) + text.count("\n\n")
+        
+        mock_count_tokens.side_effect = fake_count
+        mock_count_tokens_batch.side_effect = lambda texts, model: [fake_count(t, model) for t in texts]
         
         chunker = SmartChunker("gpt-4", max_tokens=50)
-        text = "Para1\n\nPara2\n\nPara3\n\nPara4"
+        text = "Para1 is first.\n\nPara2 is second.\n\nPara3 is third.\n\nPara4 is last."
         chunks = chunker.chunk_by_paragraphs(text)
         assert len(chunks) == 3  # Para1+Para2, Para3, Para4
-        assert "Para1\n\nPara2" in chunks[0]
-        assert mock_count_tokens.call_count >= 5
+        assert "Para1 is first.\n\nPara2" in chunks[0]
+        assert mock_count_tokens_batch.call_count == 1
     
+    @patch('toksum.core.count_tokens_batch')
     @patch('toksum.core.count_tokens')
-    def test_chunk_by_paragraphs_empty(self, mock_count_tokens):
+    def test_chunk_by_paragraphs_empty(self, mock_count_tokens, mock_count_tokens_batch):
         """Test paragraph chunking for empty text."""
         chunker = SmartChunker("gpt-4", max_tokens=50)
         chunks = chunker.chunk_by_paragraphs("")
         assert chunks == []
         mock_count_tokens.assert_not_called()
+        mock_count_tokens_batch.assert_not_called()
     
+    @patch('toksum.core.count_tokens_batch')
+    @patch('toksum.core.count_tokens')
+    def test_chunk_by_paragraphs_strict(self, mock_count_tokens, mock_count_tokens_batch):
+        """Test which blank lines separate paragraphs with and without strict."""
+        mock_count_tokens.return_value = 10
+        mock_count_tokens_batch.side_effect = lambda texts, model: [10] * len(texts)
+        chunker = SmartChunker("gpt-4", max_tokens=10)
+        text = "Para1\n\n\nPara2\n  \nPara3"
+        assert chunker.chunk_by_paragraphs(text) == ["Para1", "Para2\n  \nPara3"]
+        assert chunker.chunk_by_paragraphs(text, strict=True) == ["Para1", "Para2", "Para3"]
+        windows_text = "Para1\r\n\r\nPara2"
+        assert len(chunker.chunk_by_paragraphs(windows_text)) == 2
+        mixed_text = "Alpha\n  \nBeta\n\nGamma\r\nDelta\r\n\r\nEpsilon\n\r\nZeta"
+        assert chunker.chunk_by_paragraphs(mixed_text) == [
+            "Alpha\n  \nBeta", "Gamma\r\nDelta", "Epsilon", "Zeta"
+        ]
+        assert chunker.chunk_by_paragraphs(mixed_text, strict=True) == [
+            "Alpha", "Beta", "Gamma\r\nDelta", "Epsilon", "Zeta"
+        ]
+    
+    @patch('toksum.core.count_tokens_batch')
+    @patch('toksum.core.count_tokens')
+    def test_chunk_by_paragraphs_no_whitespace_chunks(self, mock_count_tokens, mock_count_tokens_batch):
+        """Test that paragraph chunks are trimmed and never whitespace only."""
+        mock_count_tokens.return_value = 10
+        mock_count_tokens_batch.side_effect = lambda texts, model: [10] * len(texts)
+        chunker = SmartChunker("gpt-4", max_tokens=1)
+        assert chunker.chunk_by_paragraphs("Para1\n\n \n\nPara2 text") == ["Para1", "Para2 text"]
+        assert chunker.chunk_by_paragraphs("A\n\n  \nB") == ["A", "B"]
+        assert chunker.chunk_by_paragraphs("A  \n\n  B", strict=True) == ["A", "B"]
+    
+    @patch('toksum.core.count_tokens_batch')
     @patch('toksum.core.count_tokens')
-    def test_chunk_code_python_short(self, mock_count_tokens):
+    def test_chunk_code_python_short(self, mock_count_tokens, mock_count_tokens_batch):
         """Test code chunking for short Python code."""
         mock_count_tokens.return_value = 40
+        mock_count_tokens_batch.side_effect = lambda texts, model: [40] * len(texts)
         chunker = SmartChunker("gpt-4", max_tokens=50)
         code = """
 def hello():
@@ -3034,14 +3353,13 @@ def hello():
         chunks = chunker.chunk_code(code, "python")
         assert len(chunks) == 1
         assert "def hello():" in chunks[0]
-        assert mock_count_tokens.call_count > 0
+        assert mock_count_tokens_batch.call_count == 1
     
+    @patch('toksum.core.count_tokens_batch')
     @patch('toksum.core.count_tokens')
-    def test_chunk_code_python_long(self, mock_count_tokens):
+    def test_chunk_code_python_long(self, mock_count_tokens, mock_count_tokens_batch):
         """Test code chunking for long Python splitting between functions."""
-        calls = [0]
-        def side_effect(text, model):
-            calls[0] += 1
+        def fake_count(text, model):
             if "def fibonacci" in text:
                 return 30  # First def under
             if "class Calculator" in text:
@@ -3050,7 +3368,8 @@ def hello():
                 return 25  # Fits
             return 10
         
-        mock_count_tokens.side_effect = side_effect
+        mock_count_tokens.side_effect = fake_count
+        mock_count_tokens_batch.side_effect = lambda texts, model: [fake_count(t, model) for t in texts]
         
         chunker = SmartChunker("gpt-4", max_tokens=50)
         code = """
@@ -3067,26 +3386,115 @@ class Calculator:
         assert len(chunks) == 2  # One for fibonacci, one for class
         assert "def fibonacci" in chunks[0]
         assert "class Calculator" in chunks[1]
-        assert mock_count_tokens.call_count > 0
+        assert mock_count_tokens_batch.call_count == 1
+    
+    @patch('toksum.core.count_tokens_batch')
+    @patch('toksum.core.count_tokens')
+    def test_chunk_code_python_keeps_function_and_class_apart(self, mock_count_tokens, mock_count_tokens_batch):
+        """Test that a function and a class are not merged once the text is long."""
+        mock_count_tokens.return_value = 1
+        mock_count_tokens_batch.side_effect = lambda texts, model: [1] * len(texts)
+        chunker = SmartChunker("gpt-4", max_tokens=1000)
+        code = """
+def helper_function_with_a_long_name(argument_one, argument_two):
+    return argument_one + argument_two
+
+class Container:
+    value = 1
+"""
+        chunks = chunker.chunk_code(code, "python")
+        assert len(chunks) == 2
+        assert chunks[0].startswith("def helper_function")
+        assert chunks[1].startswith("class Container")
+    
+    def test_chunk_code_python_uses_syntax_boundaries(self):
+        """Test that decorators and multi-line strings stay with their definition."""
+        chunker = SmartChunker("claude-3-opus-20240229", max_tokens=1)
+        code = '''
+import os
+
+@property
+def usage():
+    return """
+def not_a_function():
+"""
+
+class Config:
+    pass
+'''
+        chunks = chunker.chunk_code(code, "python")
+        assert len(chunks) == 3
+        assert chunks[0] == "import os"
+        assert chunks[1].startswith("@property\ndef usage():")
+        assert "def not_a_function():" in chunks[1]
+        assert chunks[2].startswith("class Config:")
+    
+    def test_chunk_code_python_unusual_line_separators(self):
+        """Test that form feeds and U+2028 do not shift the syntax tree's line numbers."""
+        chunker = SmartChunker("claude-3-opus-20240229", max_tokens=1)
+        code = "import os\n\x0cdef foo():\n    return 1\n\x0cdef bar():\n    return 2\n"
+        chunks = chunker.chunk_code(code, "python")
+        assert chunks == ["import os", "def foo():\n    return 1", "def bar():\n    return 2"]
+    
+        code = 'X = "a\u2028b"\ndef foo():\n    return 1\n'
+        chunks = chunker.chunk_code(code, "python")
+        assert chunks == ['X = "a\u2028b"', "def foo():\n    return 1"]
     
+    def test_chunk_code_python_invalid_syntax_fallback(self):
+        """Test that code which does not parse is still split on definitions."""
+        chunker = SmartChunker("claude-3-opus-20240229", max_tokens=1)
+        code = "def broken(:\n    pass\n\ndef other():\n    pass"
+        chunks = chunker.chunk_code(code, "python")
+        assert chunks == ["def broken(:\n    pass", "def other():\n    pass"]
+    
+    def test_chunk_code_python_too_deep_to_parse_fallback(self):
+        """Test that code too deeply nested for the parser falls back to line scanning."""
+        chunker = SmartChunker("claude-3-opus-20240229", max_tokens=50)
+        for code in ["x = " + "1+" * 200000 + "1\n", "x = " + "-" * 100000 + "1"]:
+            chunks = chunker.chunk_code(code, "python")
+            assert "".join(chunks) == code.strip()
+    
+    def test_chunk_code_python_does_not_warn(self):
+        """Test that parsing code with invalid escape sequences emits no warnings."""
+        chunker = SmartChunker("claude-3-opus-20240229", max_tokens=10)
+        code = 'PAT = re.compile("\\d+")\n\n\n@cached\ndef match(text):\n    return PAT.match(text)'
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            chunks = chunker.chunk_code(code, "python")
+        assert caught == []
+        assert chunks == ['PAT = re.compile("\\d+")', "@cached\ndef match(text):\n    return PAT.match(text)"]
+    
+    @patch('toksum.core.count_tokens_batch')
     @patch('toksum.core.count_tokens')
-    def test_chunk_code_non_python_fallback(self, mock_count_tokens):
+    def test_chunk_code_non_python_fallback(self, mock_count_tokens, mock_count_tokens_batch):
         """Test code chunking falls back to paragraphs for non-Python."""
         mock_count_tokens.return_value = 30
-        chunker = SmartChunker("gpt-4", max_tokens=50)
+        mock_count_tokens_batch.side_effect = lambda texts, model: [30] * len(texts)
+        chunker = SmartChunker("gpt-4", max_tokens=35)
         code = "function hello() { console.log('Hi'); }"
         chunks = chunker.chunk_code(code, "javascript")
         assert len(chunks) == 1  # Fallback to paragraphs
         assert code in chunks[0]
-        assert mock_count_tokens.call_count > 0
+        assert mock_count_tokens_batch.call_count == 1
     
+    @patch('toksum.core.count_tokens_batch')
     @patch('toksum.core.count_tokens')
-    def test_chunk_code_empty(self, mock_count_tokens):
+    def test_chunk_code_empty(self, mock_count_tokens, mock_count_tokens_batch):
         """Test code chunking for empty code."""
         chunker = SmartChunker("gpt-4", max_tokens=50)
         chunks = chunker.chunk_code("", "python")
         assert chunks == []
         mock_count_tokens.assert_not_called()
+        mock_count_tokens_batch.assert_not_called()
+    
+    def test_chunks_respect_limit_with_approximation(self):
+        """Test that every multi-sentence chunk fits for an approximated model."""
+        chunker = SmartChunker("claude-3-opus-20240229", max_tokens=30)
+        text = " ".join(f"Sentence number {i} has a few more words in it." for i in range(40))
+        chunks = chunker.chunk_by_sentences(text)
+        assert " ".join(chunks) == text
+        for chunk in chunks:
+            assert count_tokens(chunk, "claude-3-opus-20240229") <= 30
 
 
 if __name__ == "__main__":
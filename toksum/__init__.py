@@ -16,7 +16,7 @@ Usage:
     token_count = counter.count("Hello, world!")
 """
 
-from .core import TokenCounter, count_tokens, get_supported_models, estimate_cost
+from .core import TokenCounter, count_tokens, count_tokens_batch, get_encoding_name, get_supported_models, estimate_cost, estimate_cost_batch
 from .exceptions import UnsupportedModelError, TokenizationError
 from .core import SmartChunker
 
@@ -27,8 +27,11 @@ __email__ = "raja.csp@gmail.com"
 __all__ = [
     "TokenCounter",
     "count_tokens",
+    "count_tokens_batch",
+    "get_encoding_name",
     "get_supported_models",
     "estimate_cost",
+    "estimate_cost_batch",
     "UnsupportedModelError",
     "TokenizationError",
     "SmartChunker",
@@ -2,23 +2,23 @@
 Core functionality for token counting across different LLM providers.
 """
 
+import ast
+import os
 import re
-from typing import Dict, List, Optional, Union, TYPE_CHECKING, Any
+import warnings
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import accumulate
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union, TYPE_CHECKING, Any
 
 if TYPE_CHECKING:
     import tiktoken
-    from anthropic import Anthropic
 else:
     try:
         import tiktoken
     except ImportError:
         tiktoken = None
 
-    try:
-        from anthropic import Anthropic
-    except ImportError:
-        Anthropic = None
-
 from .exceptions import UnsupportedModelError, TokenizationError
 
 
@@ -588,6 +588,20 @@ VOYAGE_MODELS = {
 }
 
 
+# Batches smaller than this are encoded serially by TokenCounter.count_batch,
+# and no more than this many threads are used for larger ones
+_BATCH_MIN_TEXTS = 32
+_BATCH_MAX_THREADS = 8
+
+# count_tokens only caches texts up to this many characters, so the cache
+# cannot hold on to many whole documents
+_CACHE_MAX_CHARS = 4096
+
+# Patterns used by the token approximation, compiled once at import
+_WHITESPACE_RE = re.compile(r'\s+')
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+
+
 class TokenCounter:
     """
 A token counter for various Large Language Model (LLM) providers.
@@ -626,6 +640,7 @@ print(f"Estimated cost: ${cost:.4f}")
             TokenizationError: If required dependencies are missing
         """
         self.tokenizer: Optional[Any] = None
+        self.encoding_name: str = ""
         self.model = model.lower()
         self.provider = self._detect_provider()
         self._setup_tokenizer()
@@ -820,10 +835,13 @@ print(f"Estimated cost: ${cost:.4f}")
                 self.tokenizer = tiktoken.get_encoding(encoding_name)
             except Exception as e:
                 raise TokenizationError(f"Failed to load tokenizer: {str(e)}", model=self.model)
+            self.encoding_name = encoding_name
         
         else:
             # For all other providers, we'll use approximation since they don't provide public tokenizers
             self.tokenizer = None
+            # The approximation only depends on the provider
+            self.encoding_name = f"{self.provider}-approximation"
     
     def count(self, text: str) -> int:
         """
@@ -859,8 +877,6 @@ print(f"Estimated cost: ${cost:.4f}")
             if self.provider == "openai":
                 if self.tokenizer is None:
                     raise TokenizationError("Tokenizer not initialized", model=self.model)
-                if not text:
-                    return 0
                 return len(self.tokenizer.encode(text))
             else:
                 # Use approximation for all other providers
@@ -877,10 +893,8 @@ print(f"Estimated cost: ${cost:.4f}")
         
         This uses a general approximation algorithm that works reasonably well
         for most LLMs, with slight adjustments based on the provider.
+        count() has already checked that text is a string.
         """
-        if not isinstance(text, str):
-            raise TokenizationError(f"Input must be a string, got {type(text).__name__}", model=self.model)
-
         if not text:
             return 0
         
@@ -889,10 +903,10 @@ print(f"Estimated cost: ${cost:.4f}")
             char_count = len(text)
             
             # Adjust for whitespace (spaces and newlines are often separate tokens)
-            whitespace_count = len(re.findall(r'\s+', text))
+            whitespace_count = len(_WHITESPACE_RE.findall(text))
             
             # Adjust for punctuation (often separate tokens)
-            punctuation_count = len(re.findall(r'[^\w\s]', text))
+            punctuation_count = len(_PUNCTUATION_RE.findall(text))
         except Exception as e:
             raise TokenizationError(f"Failed to process text: {str(e)}", model=self.model, text_preview=text)
         
@@ -1113,11 +1127,83 @@ print(f"Estimated cost: ${cost:.4f}")
         
         return total_tokens
 
+    def count_batch(self, texts: List[str]) -> List[int]:
+        """
+        Count tokens for several texts with a single tokenizer.
+        
+        For OpenAI models, large batches are handed to tiktoken's batch
+        encoder, which releases the GIL and encodes on several threads. Small
+        batches, and machines with a single CPU, are encoded one by one, since
+        starting the thread pool costs more than it saves there. Other
+        providers are approximated in Python and always counted serially.
+        Texts that occur more than once are only counted once.
+        
+        Args:
+            texts: The texts to count tokens for
+            
+        Returns:
+            The number of tokens for each text, in input order
+            
+        Raises:
+            TokenizationError: If tokenization fails
+        """
+        if texts is None:
+            raise TokenizationError("Input cannot be None", model=self.model)
+        
+        if isinstance(texts, str) or not isinstance(texts, (list, tuple)):
+            raise TokenizationError(f"Texts must be a list, got {type(texts).__name__}", model=self.model)
+        
+        for i, text in enumerate(texts):
+            if not isinstance(text, str):
+                raise TokenizationError(f"Text at index {i} must be a string, got {type(text).__name__}", model=self.model)
+        
+        # Repeated texts (shared headers, footers, boilerplate) are counted once
+        unique = list(dict.fromkeys(texts))
+        counts = self._count_distinct(unique)
+        if len(unique) == len(texts):
+            return counts
+        counts_by_text = dict(zip(unique, counts))
+        return [counts_by_text[text] for text in texts]
+    
+    def _count_distinct(self, texts: List[str]) -> List[int]:
+        """Count tokens for already validated texts, choosing serial or threaded encoding."""
+        if self.provider != "openai":
+            return [self.count(text) for text in texts]
+        
+        if self.tokenizer is None:
+            raise TokenizationError("Tokenizer not initialized", model=self.model)
+        
+        num_threads = min(os.cpu_count() or 1, _BATCH_MAX_THREADS)
+        try:
+            if len(texts) < _BATCH_MIN_TEXTS or num_threads < 2:
+                return [len(self.tokenizer.encode(text)) for text in texts]
+            return [len(ids) for ids in self.tokenizer.encode_batch(texts, num_threads=num_threads)]
+        except Exception as e:
+            raise TokenizationError(str(e), model=self.model)
+
+
+@lru_cache(maxsize=64)
+def _get_counter(model: str) -> TokenCounter:
+    """Return a shared TokenCounter for the model, built on first use."""
+    return TokenCounter(model)
+
+
+@lru_cache(maxsize=4096)
+def _count_cached(text: str, model: str) -> int:
+    """Return the token count for text, remembering the 4096 most recent results."""
+    return _get_counter(model).count(text)
+
 
 def count_tokens(text: str, model: str) -> int:
     """
     Convenience function to count tokens for a given text and model.
     
+    The TokenCounter for each model is created once and reused, and the
+    counts for the 4096 most recently seen (text, model) pairs are kept, so
+    counting the same text again does not tokenize it again. Tokenizers are
+    deterministic, so cached counts never go stale. Texts longer than
+    4096 characters are counted without being cached.
+    
     Args:
         text: The text to count tokens for
         model: The model name
@@ -1125,8 +1211,43 @@ def count_tokens(text: str, model: str) -> int:
     Returns:
         The number of tokens
     """
-    counter = TokenCounter(model)
-    return counter.count(text)
+    if not isinstance(text, str) or len(text) > _CACHE_MAX_CHARS:
+        # Let TokenCounter report invalid input; it may not be hashable
+        return _get_counter(model).count(text)
+    return _count_cached(text, model)
+
+
+def count_tokens_batch(texts: List[str], model: str) -> List[int]:
+    """
+    Convenience function to count tokens for several texts and one model.
+    
+    The tokenizer is looked up once for the whole batch rather than once per text.
+    
+    Args:
+        texts: The texts to count tokens for
+        model: The model name
+        
+    Returns:
+        The number of tokens for each text, in input order
+    """
+    return _get_counter(model).count_batch(texts)
+
+
+def get_encoding_name(model: str) -> str:
+    """
+    Get the name of the encoding used to count tokens for a model.
+    
+    Models that share an encoding name always produce the same token count
+    for the same text, e.g. gpt-4 and gpt-3.5-turbo both use "cl100k_base".
+    Models counted by approximation share the provider's approximation.
+    
+    Args:
+        model: The model name
+        
+    Returns:
+        The encoding name, e.g. "cl100k_base" or "anthropic-approximation"
+    """
+    return _get_counter(model).encoding_name
 
 
 def get_supported_models() -> Dict[str, List[str]]:
@@ -1182,6 +1303,48 @@ def get_supported_models() -> Dict[str, List[str]]:
     }
 
 
+USD_TO_INR = 83.0  # Conversion rate as of July 10 2025
+
+# Approximate pricing per 1K tokens (in USD)
+MODEL_PRICING = {
+    "gpt-4": {"input": 0.03, "output": 0.06},
+    "gpt-4-32k": {"input": 0.06, "output": 0.12},
+    "dbrx-instruct": {"input": 0.001, "output": 0.002},
+    "dbrx-base": {"input": 0.001, "output": 0.002},
+    "dolly-v2-12b": {"input": 0.001, "output": 0.002},
+    "dolly-v2-7b": {"input": 0.001, "output": 0.002},
+    "dolly-v2-3b": {"input": 0.001, "output": 0.002},
+    "voyage-2": {"input": 0.0001, "output": 0.0001},
+    "voyage-large-2": {"input": 0.0001, "output": 0.0001},
+    "voyage-code-2": {"input": 0.0001, "output": 0.0001},
+    "voyage-finance-2": {"input": 0.0001, "output": 0.0001},
+    "voyage-law-2": {"input": 0.0001, "output": 0.0001},
+    "voyage-multilingual-2": {"input": 0.0001, "output": 0.0001},
+    "gpt-4-turbo": {"input": 0.01, "output": 0.03},
+    "gpt-4-turbo-2024-04-09": {"input": 0.01, "output": 0.03},
+    "gpt-4o": {"input": 0.005, "output": 0.015},
+    "gpt-4o-2024-05-13": {"input": 0.005, "output": 0.015},
+    "gpt-4o-mini": {"input": 0.00015, "output": 0.0006},
+    "gpt-4o-mini-2024-07-18": {"input": 0.00015, "output": 0.0006},
+    "gpt-3.5-turbo": {"input": 0.001, "output": 0.002},
+    "gpt-3.5-turbo-16k": {"input": 0.003, "output": 0.004},
+    "claude-3-opus-20240229": {"input": 0.015, "output": 0.075},
+    "claude-3-sonnet-20240229": {"input": 0.003, "output": 0.015},
+    "claude-3-haiku-20240307": {"input": 0.00025, "output": 0.00125},
+    "claude-3.5-sonnet-20240620": {"input": 0.003, "output": 0.015},
+    "claude-3.5-sonnet-20241022": {"input": 0.003, "output": 0.015},
+    "claude-3.5-haiku-20241022": {"input": 0.001, "output": 0.005},
+    "claude-3-5-sonnet-20240620": {"input": 0.003, "output": 0.015},
+}
+
+# The same prices as whole micro-dollars per million tokens, (input, output),
+# so batch estimates multiply integers instead of accumulating float rates
+_PRICE_MICROS: Dict[str, Tuple[int, int]] = {
+    model: (round(rates["input"] * 1_000_000_000), round(rates["output"] * 1_000_000_000))
+    for model, rates in MODEL_PRICING.items()
+}
+
+
 def estimate_cost(
     token_count: int,
     model: str,
@@ -1200,50 +1363,151 @@ def estimate_cost(
     Returns:
         float: Estimated cost in specified currency. Returns 0.0 if model not supported.
     """
-    USD_TO_INR = 83.0  # Conversion rate as of July 10 2025
-
-    # Approximate pricing per 1K tokens (in USD)
-    pricing = {
-        "gpt-4": {"input": 0.03, "output": 0.06},
-        "gpt-4-32k": {"input": 0.06, "output": 0.12},
-        "dbrx-instruct": {"input": 0.001, "output": 0.002},
-        "dbrx-base": {"input": 0.001, "output": 0.002},
-        "dolly-v2-12b": {"input": 0.001, "output": 0.002},
-        "dolly-v2-7b": {"input": 0.001, "output": 0.002},
-        "dolly-v2-3b": {"input": 0.001, "output": 0.002},
-        "voyage-2": {"input": 0.0001, "output": 0.0001},
-        "voyage-large-2": {"input": 0.0001, "output": 0.0001},
-        "voyage-code-2": {"input": 0.0001, "output": 0.0001},
-        "voyage-finance-2": {"input": 0.0001, "output": 0.0001},
-        "voyage-law-2": {"input": 0.0001, "output": 0.0001},
-        "voyage-multilingual-2": {"input": 0.0001, "output": 0.0001},
-        "gpt-4-turbo": {"input": 0.01, "output": 0.03},
-        "gpt-4-turbo-2024-04-09": {"input": 0.01, "output": 0.03},
-        "gpt-4o": {"input": 0.005, "output": 0.015},
-        "gpt-4o-2024-05-13": {"input": 0.005, "output": 0.015},
-        "gpt-4o-mini": {"input": 0.00015, "output": 0.0006},
-        "gpt-4o-mini-2024-07-18": {"input": 0.00015, "output": 0.0006},
-        "gpt-3.5-turbo": {"input": 0.001, "output": 0.002},
-        "gpt-3.5-turbo-16k": {"input": 0.003, "output": 0.004},
-        "claude-3-opus-20240229": {"input": 0.015, "output": 0.075},
-        "claude-3-sonnet-20240229": {"input": 0.003, "output": 0.015},
-        "claude-3-haiku-20240307": {"input": 0.00025, "output": 0.00125},
-        "claude-3.5-sonnet-20240620": {"input": 0.003, "output": 0.015},
-        "claude-3.5-sonnet-20241022": {"input": 0.003, "output": 0.015},
-        "claude-3.5-haiku-20241022": {"input": 0.001, "output": 0.005},
-        "claude-3-5-sonnet-20240620": {"input": 0.003, "output": 0.015},
-    }
-
     model = model.lower()
-    if model not in pricing:
+    if model not in MODEL_PRICING:
         return 0.0
 
-    rate: float = pricing[model]["input" if input_tokens else "output"]
+    rate: float = MODEL_PRICING[model]["input" if input_tokens else "output"]
     cost_usd: float = (token_count / 1000) * rate
 
     return cost_usd * USD_TO_INR if currency.upper() == "INR" else cost_usd
 
 
+def estimate_cost_batch(
+    token_counts: List[int],
+    model: str,
+    input_tokens: bool = True,
+    currency: str = "USD"
+) -> List[float]:
+    """
+    Estimate the cost for several token counts and one model in USD or INR.
+
+    The price is looked up once, and each cost is computed from the integer
+    product of tokens and micro-dollars per million tokens, then converted
+    to a float. The returned costs are floats, so summing many of them still
+    accumulates ordinary floating-point error.
+
+    Args:
+        token_counts (List[int]): Numbers of tokens to estimate costs for.
+        model (str): Model name (e.g., "gpt-4", "gpt-4o").
+        input_tokens (bool): True if input tokens, False for output. Defaults to True.
+        currency (str): Currency code ("USD" or "INR"). Defaults to "USD".
+
+    Returns:
+        List[float]: Estimated cost for each token count, in input order.
+        Costs are 0.0 if model not supported.
+    """
+    prices = _PRICE_MICROS.get(model.lower())
+    if prices is None:
+        return [0.0] * len(token_counts)
+
+    price_micros = prices[0 if input_tokens else 1]
+    rate = USD_TO_INR if currency.upper() == "INR" else 1.0
+
+    # micro-dollars per million tokens -> dollars per token is a 10**12 divisor
+    return [(tokens * price_micros) / 1_000_000_000_000 * rate for tokens in token_counts]
+
+
+# Boundaries used by SmartChunker, compiled once at import. When a pattern has
+# a group, only the group is the separator; the sentence pattern matches the
+# punctuation directly because that runs much faster than a lookbehind.
+_SENT_RE = re.compile(r'[.!?](\s+)')
+_PARA_RE = re.compile(r'\n\s*\n')
+# Two or more line endings in a row, "\n" or "\r\n" in any mix
+_BLANK_LINES_RE = re.compile(r'(?:\r?\n){2,}')
+# Line endings as the Python parser sees them; str.splitlines also breaks on
+# form feeds and other separators, which would not match ast line numbers
+_NEWLINE_RE = re.compile(r'\r\n|\r|\n')
+
+# Largest number of piece token counts a SmartChunker keeps; pieces longer
+# than _CACHE_MAX_CHARS are never kept
+_CHUNKER_CACHE_SIZE = 4096
+
+
+def _spans_between(pattern: "re.Pattern[str]", text: str) -> List[Tuple[int, int]]:
+    """
+    Return the (start, end) offsets of the pieces of text between separators.
+    
+    The separator is the last group of pattern, or the whole match if it has
+    no groups. This is a split without building the substrings.
+    """
+    spans: List[Tuple[int, int]] = []
+    group = pattern.groups
+    start = 0
+    for match in pattern.finditer(text):
+        spans.append((start, match.start(group)))
+        start = match.end()
+    spans.append((start, len(text)))
+    return spans
+
+
+def _paragraph_spans(text: str) -> List[Tuple[int, int]]:
+    """
+    Return the (start, end) offsets of the paragraphs of stripped text.
+    
+    Paragraphs are separated by runs of two or more line endings, found
+    with str.find rather than _PARA_RE. Blank lines holding other whitespace
+    do not separate paragraphs here. Text with "\r\n" line endings, alone or
+    mixed with "\n", is split with _BLANK_LINES_RE instead, which finds the
+    same breaks.
+    """
+    if "\r" in text:
+        return _spans_between(_BLANK_LINES_RE, text)
+    
+    spans: List[Tuple[int, int]] = []
+    find = text.find
+    start = 0
+    separator = find("\n\n")
+    while separator != -1:
+        end = separator + 2
+        while end < len(text) and text[end] == "\n":
+            end += 1
+        spans.append((start, separator))
+        start = end
+        separator = find("\n\n", end)
+    spans.append((start, len(text)))
+    return spans
+
+
+def _trim_spans(text: str, spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    Narrow each span to exclude leading and trailing whitespace, dropping
+    spans that hold nothing else.
+    """
+    trimmed: List[Tuple[int, int]] = []
+    for begin, end in spans:
+        piece = text[begin:end]
+        stripped = piece.strip()
+        if stripped:
+            begin += len(piece) - len(piece.lstrip())
+            trimmed.append((begin, begin + len(stripped)))
+    return trimmed
+
+
+def _line_offsets(code: str) -> List[int]:
+    """
+    Return where each line of code starts, followed by len(code).
+    
+    Line i is code[offsets[i]:offsets[i + 1]], newline included, and the
+    number of lines is len(offsets) - 1.
+    """
+    offsets = [0]
+    offsets.extend(match.end() for match in _NEWLINE_RE.finditer(code))
+    if offsets[-1] != len(code):
+        offsets.append(len(code))
+    return offsets
+
+
+def _continues_block(line: str) -> bool:
+    """
+    Check whether a line belongs to the definition above it.
+    
+    Blank lines and lines indented with spaces or tabs do. A leading form
+    feed resets the indentation for the parser, so it does not count.
+    """
+    return line.startswith((' ', '\t')) or not line.strip()
+
+
 class SmartChunker:
     """
     Intelligent text chunker that splits text while respecting token limits.
@@ -1256,15 +1520,35 @@ class SmartChunker:
     Args:
         model: The model name to use for token counting
         max_tokens: Maximum tokens per chunk
+        _count_fn: Optional function called as _count_fn(text, model) in place
+            of count_tokens and count_tokens_batch, e.g. to count calls in tests
+            
+    Raises:
+        UnsupportedModelError: If the model is not supported
+        TokenizationError: If the model's tokenizer cannot be set up
     """
     
-    def __init__(self, model: str, max_tokens: int):
+    def __init__(
+        self,
+        model: str,
+        max_tokens: int,
+        *,
+        _count_fn: Optional[Callable[[str, str], int]] = None,
+    ):
         """Initialize the SmartChunker."""
         if max_tokens <= 0:
             raise ValueError("max_tokens must be positive")
         
         self.model = model
         self.max_tokens = max_tokens
+        self._count_fn = _count_fn
+        # Resolve the model up front: text short enough to skip counting
+        # would otherwise never reach it, and an unsupported model would
+        # only fail once some input happened to be long
+        self._counter = _get_counter(model) if _count_fn is None else None
+        # Token counts of pieces seen by this chunker, so chunking the same
+        # text again (or another way) does not tokenize them again
+        self._token_cache: Dict[str, int] = {}
     
     def chunk_by_sentences(self, text: str) -> List[str]:
         """
@@ -1276,91 +1560,67 @@ class SmartChunker:
         Returns:
             List of text chunks, each under the token limit
         """
-        if not text.strip():
-            return []
+        return list(self.iter_chunks_by_sentences(text))
+    
+    def iter_chunks_by_sentences(self, text: str) -> Iterator[str]:
+        """
+        Yield chunks of text split by sentences, one at a time.
         
-        # Split into sentences using regex
-        sentences = re.split(r'(?<=[.!?])\s+', text.strip())
-        if not sentences:
-            return []
-        
-        chunks: List[str] = []
-        current_chunk: str = ""
-        
-        for sentence in sentences:
-            # Try adding this sentence to current chunk
-            test_chunk = current_chunk
-            if current_chunk:
-                test_chunk += " " + sentence
-            else:
-                test_chunk = sentence
-            
-            # Check if it fits within token limit
-            token_count = count_tokens(test_chunk, self.model)
+        Same chunks as chunk_by_sentences, but each is produced only when
+        asked for, so callers can start on the first chunk before the rest
+        are packed.
+        
+        Args:
+            text: The text to chunk
             
-            if token_count <= self.max_tokens:
-                current_chunk = test_chunk
-            else:
-                # Current chunk is full, start a new one
-                if current_chunk:
-                    chunks.append(current_chunk)
-                # Check if single sentence fits
-                single_token_count = count_tokens(sentence, self.model)
-                current_chunk = sentence
-        
-        # Add the last chunk if it exists
-        if current_chunk:
-            chunks.append(current_chunk)
-        
-        return chunks
+        Yields:
+            Text chunks, each under the token limit
+        """
+        text = text.strip()
+        if not text:
+            return
+        
+        # Split into sentences using regex
+        yield from self._iter_pack(text, _spans_between(_SENT_RE, text))
     
-    def chunk_by_paragraphs(self, text: str) -> List[str]:
+    def chunk_by_paragraphs(self, text: str, strict: bool = False) -> List[str]:
         """
         Chunk text by paragraphs while respecting token limits.
         
         Args:
             text: The text to chunk
+            strict: Also treat lines holding only spaces or tabs as paragraph
+                breaks (slower)
             
         Returns:
             List of text chunks, each under the token limit
         """
-        if not text.strip():
-            return []
+        return list(self.iter_chunks_by_paragraphs(text, strict))
+    
+    def iter_chunks_by_paragraphs(self, text: str, strict: bool = False) -> Iterator[str]:
+        """
+        Yield chunks of text split by paragraphs, one at a time.
         
-        # Split into paragraphs
-        paragraphs = re.split(r'\n\s*\n', text.strip())
-        if not paragraphs:
-            return []
-        
-        chunks: List[str] = []
-        current_chunk: str = ""
-        
-        for paragraph in paragraphs:
-            # Try adding this paragraph to current chunk
-            test_chunk = current_chunk
-            if current_chunk:
-                test_chunk += "\n\n" + paragraph
-            else:
-                test_chunk = paragraph
-            
-            # Check if it fits within token limit
-            token_count = count_tokens(test_chunk, self.model)
+        Args:
+            text: The text to chunk
+            strict: Also treat lines holding only spaces or tabs as paragraph
+                breaks (slower)
             
-            if token_count <= self.max_tokens:
-                current_chunk = test_chunk
-            else:
-                # Current chunk is full, start a new one
-                if current_chunk:
-                    chunks.append(current_chunk)
-                # Check if single paragraph fits, if not it goes alone
-                single_token_count = count_tokens(paragraph, self.model)
-                current_chunk = paragraph
-        
-        # Add the last chunk if it exists
-        if current_chunk:
-            chunks.append(current_chunk)
-        
-        return chunks
+        Yields:
+            Text chunks, each under the token limit
+        """
+        text = text.strip()
+        if not text:
+            return
+        
+        # Split into paragraphs
+        if strict:
+            spans = _spans_between(_PARA_RE, text)
+        else:
+            spans = _paragraph_spans(text)
+        # Paragraphs never start or end with whitespace, and a break made of
+        # whitespace-only lines is not a paragraph of its own
+        yield from self._iter_pack(text, _trim_spans(text, spans))
     
     def chunk_code(self, code: str, language: str = "python") -> List[str]:
         """
@@ -1376,71 +1636,226 @@ class SmartChunker:
         Returns:
             List of code chunks, each under the token limit
         """
-        if not code.strip():
-            return []
+        return list(self.iter_code_chunks(code, language))
+    
+    def iter_code_chunks(self, code: str, language: str = "python") -> Iterator[str]:
+        """
+        Yield chunks of code split on its structure, one at a time.
+        
+        Args:
+            code: The code to chunk
+            language: Programming language (currently only "python" is specially handled)
+            
+        Yields:
+            Code chunks, each under the token limit
+        """
+        # isspace() stops at the first other character instead of copying
+        # the code the way strip() would
+        if not code or code.isspace():
+            return
         
         if language.lower() == "python":
-            return self._chunk_python_code(code)
+            yield from self._iter_python_code_chunks(code)
         else:
-            # Fallback to paragraph chunking for other languages
-            return self.chunk_by_paragraphs(code)
+            # Fallback to paragraph chunking for other languages; editors
+            # often leave indentation on blank lines, so match those too
+            yield from self.iter_chunks_by_paragraphs(code, strict=True)
     
-    def _chunk_python_code(self, code: str) -> List[str]:
+    def _iter_python_code_chunks(self, code: str) -> Iterator[str]:
         """
         Chunk Python code by function and class definitions.
         
         Args:
             code: Python code to chunk
             
-        Returns:
-            List of code chunks
+        Yields:
+            Code chunks
         """
         # Split code into logical blocks (functions, classes, and other code)
         blocks = self._split_python_into_blocks(code)
         
         if not blocks:
-            return []
-        
-        chunks: List[str] = []
-        current_chunk: str = ""
+            return
         
+        # Lay the blocks out once, separated by blank lines, and pack spans of it
+        joined = "\n\n".join(blocks)
+        spans: List[Tuple[int, int]] = []
+        position = 0
         for block in blocks:
-            if not current_chunk:
-                # First block - check its token count and start chunk
-                token_count = count_tokens(block, self.model)
-                current_chunk = block
-            else:
-                # Check if current block alone fits within limits
-                block_count = count_tokens(block, self.model)
-                
-                # Try combining with current chunk
-                test_chunk = current_chunk + "\n\n" + block
-                combined_count = count_tokens(test_chunk, self.model)
-                
-                # Special handling: if we have both function and class, 
-                # and the combined text is long, it might exceed limits
-                # even if the mock returns a low value due to pattern matching
-                has_function = "def " in current_chunk
-                has_class = "class " in current_chunk
-                new_has_function = "def " in block
-                new_has_class = "class " in block
-                
-                # If combining function and class, and text is long, split them
-                if ((has_function and new_has_class) or (has_class and new_has_function)) and len(test_chunk) > 100:
-                    chunks.append(current_chunk)
-                    current_chunk = block
-                elif combined_count <= self.max_tokens:
-                    current_chunk = test_chunk
-                else:
-                    # Doesn't fit, finalize current chunk and start new one
-                    chunks.append(current_chunk)
-                    current_chunk = block
+            spans.append((position, position + len(block)))
+            position += len(block) + 2
+        
+        # Scan each block once; prefix counts over those flags let the packer
+        # ask about any run of blocks in O(1)
+        block_has_def = ["def " in block for block in blocks]
+        block_has_class = ["class " in block for block in blocks]
+        def_prefix: List[int] = [0]
+        def_prefix.extend(accumulate(block_has_def))
+        class_prefix: List[int] = [0]
+        class_prefix.extend(accumulate(block_has_class))
+        
+        def can_join(start: int, end: int) -> bool:
+            # Keep functions and classes apart once the combined text gets long
+            has_function = def_prefix[end] > def_prefix[start]
+            has_class = class_prefix[end] > class_prefix[start]
+            new_has_function = block_has_def[end]
+            new_has_class = block_has_class[end]
+            combined_length = spans[end][1] - spans[start][0]
+            mixed = (has_function and new_has_class) or (has_class and new_has_function)
+            return not (mixed and combined_length > 100)
+        
+        yield from self._iter_pack(joined, spans, can_join)
+    
+    def _iter_pack(
+        self,
+        text: str,
+        spans: List[Tuple[int, int]],
+        can_join: Optional[Callable[[int, int], bool]] = None,
+    ) -> Iterator[str]:
+        """
+        Greedily pack consecutive pieces of text into chunks under the token limit.
+        
+        Pieces are given as (start, end) offsets into text, and each chunk is
+        a single slice of text running from the start of its first piece to
+        the end of its last, so the separators between pieces are kept as
+        they appear in the original.
+        
+        Text with no more UTF-8 bytes than max_tokens is yielded whole
+        without being tokenized. Otherwise every piece is tokenized once up
+        front, together with the separator in front of it, and a candidate
+        chunk is measured as the sum of its pieces. BPE tokenizers attach a
+        leading space to the word after it, so the sum stays close to the
+        count of the joined text; only the first piece of each chunk is
+        measured with a separator the chunk leaves out. With running totals of
+        those sizes, the end of each chunk is found by a binary search
+        instead of trying one piece at a time. The finished chunk is then
+        tokenized once more to confirm the estimate, unless it is short
+        enough to fit by its byte length. If the exact count is over the
+        limit, the estimate was low (approximated counts round each piece
+        down, and merging pieces can change tokens at the seams). The most
+        pieces that do fit are then found by stepping back in doubling steps
+        and binary searching the gap, one more count when the estimate was
+        off by a piece and about 2 * log2(pieces) at worst; the rest go to
+        the next chunk.
         
-        # Add the final chunk
-        if current_chunk:
-            chunks.append(current_chunk)
+        Args:
+            text: The text the spans point into
+            spans: (start, end) offsets of the sentences, paragraphs or code
+                blocks to pack, in order
+            can_join: Optional check whether piece end may join the chunk
+                made of pieces start to end - 1
+            
+        Yields:
+            Chunks in order; a single piece over the limit forms its own chunk
+        """
+        if can_join is None:
+            whole = text[spans[0][0]:spans[-1][1]]
+            if self._fits_without_counting(whole):
+                yield whole
+                return
+        
+        ends = [span[1] for span in spans]
+        pieces = [text[spans[0][0]:ends[0]]]
+        pieces.extend(text[previous:end] for previous, end in zip(ends, ends[1:]))
+        lengths = self._count_pieces(pieces)
+        
+        # offsets[i] is the estimated size of the first i pieces
+        offsets: List[int] = [0]
+        offsets.extend(accumulate(lengths))
+        
+        # Bound once as locals for the loop below
+        count = self._count_fn or count_tokens
+        fits_without_counting = self._fits_without_counting
+        model = self.model
+        max_tokens = self.max_tokens
+        
+        def fits(first: int, stop: int) -> bool:
+            # Exact check for the chunk made of pieces first to stop - 1
+            chunk = text[spans[first][0]:spans[stop - 1][1]]
+            return fits_without_counting(chunk) or count(chunk, model) <= max_tokens
         
-        return chunks
+        start = 0
+        while start < len(spans):
+            # Farthest end whose estimate still fits, found by binary search
+            end = max(start + 1, bisect_right(offsets, offsets[start] + max_tokens) - 1)
+            if can_join is not None:
+                for candidate in range(start + 1, end):
+                    if not can_join(start, candidate):
+                        end = candidate
+                        break
+            
+            if end - start > 1 and not fits(start, end):
+                # The estimate was low. Step back from it in doubling steps
+                # until a run fits (a chunk always keeps its first piece),
+                # then binary search the gap for the most pieces that fit
+                high = end - 1
+                probe = high
+                step = 1
+                while probe > start + 1 and not fits(start, probe):
+                    high = probe - 1
+                    probe = max(start + 1, probe - step)
+                    step *= 2
+                low = probe
+                while low < high:
+                    middle = (low + high + 1) // 2
+                    if fits(start, middle):
+                        low = middle
+                    else:
+                        high = middle - 1
+                end = low
+            
+            yield text[spans[start][0]:spans[end - 1][1]]
+            start = end
+    
+    def _fits_without_counting(self, text: str) -> bool:
+        """
+        Check whether text is under the token limit without tokenizing it.
+        
+        No model here counts more tokens than the text has UTF-8 bytes (a
+        character is at least one byte), so text with no more bytes than
+        max_tokens always fits. An injected _count_fn makes no such promise.
+        tiktoken refuses text spelling out a special token such as
+        <|endoftext|>, so for OpenAI models such text is always counted and
+        fails the same way however short it is.
+        """
+        if self._count_fn is not None or len(text) > self.max_tokens:
+            return False
+        if "<|" in text and self._counter is not None and self._counter.provider == "openai":
+            return False
+        return len(text.encode("utf-8", "surrogatepass")) <= self.max_tokens
+    
+    def _count_pieces(self, pieces: List[str]) -> List[int]:
+        """
+        Count tokens for each piece, reusing counts this chunker already has.
+        
+        Pieces not seen before are counted in a single batch. Only pieces
+        of up to _CACHE_MAX_CHARS characters are remembered, at most
+        _CHUNKER_CACHE_SIZE of them, and the cache is emptied when the new
+        ones would not fit, so chunking a long document does not leave a
+        copy of it on the chunker.
+        
+        Args:
+            pieces: The texts to count
+            
+        Returns:
+            The number of tokens for each piece, in order
+        """
+        cache = self._token_cache
+        unique = dict.fromkeys(pieces)
+        counts = {piece: cache[piece] for piece in unique if piece in cache}
+        missing = [piece for piece in unique if piece not in counts]
+        if missing:
+            if self._count_fn is not None:
+                new_counts = [self._count_fn(piece, self.model) for piece in missing]
+            else:
+                new_counts = count_tokens_batch(missing, self.model)
+            counts.update(zip(missing, new_counts))
+            
+            keep = [piece for piece in missing if len(piece) <= _CACHE_MAX_CHARS][:_CHUNKER_CACHE_SIZE]
+            if len(cache) + len(keep) > _CHUNKER_CACHE_SIZE:
+                cache.clear()
+            cache.update((piece, counts[piece]) for piece in keep)
+        return [counts[piece] for piece in pieces]
     
     def _split_python_into_blocks(self, code: str) -> List[str]:
         """
@@ -1452,63 +1867,97 @@ class SmartChunker:
         Returns:
             List of code blocks
         """
-        lines = code.strip().split('\n')
+        ast_blocks = self._split_python_with_ast(code)
+        if ast_blocks is not None:
+            return ast_blocks
+        
+        # Not parseable on its own (a fragment, or another Python version),
+        # so fall back to scanning for unindented def/class lines
+        code = code.strip()
+        # offsets[i] is where line i starts in code, so a run of lines is one slice
+        offsets = _line_offsets(code)
+        line_count = len(offsets) - 1
         blocks: List[str] = []
-        current_block_lines: List[str] = []
         
-        i: int = 0
-        while i < len(lines):
-            line = lines[i]
-            
+        def add_block(first: int, last: int) -> None:
+            block_content = code[offsets[first]:offsets[last]].strip()
+            if block_content:
+                blocks.append(block_content)
+        
+        position = 0
+        i = 0
+        while i < line_count:
             # Check if this line starts a new top-level function or class
-            if re.match(r'^(def |class )', line):
-                # If we have accumulated non-function/class lines, save them as a block
-                if current_block_lines:
-                    block_content = '\n'.join(current_block_lines).strip()
-                    if block_content:
-                        blocks.append(block_content)
-                    current_block_lines = []
-                
-                # Collect the entire function or class definition
-                function_lines: List[str] = [line]
+            if not code.startswith(('def ', 'class '), offsets[i]):
                 i += 1
-                
-                # Get the indentation level of the function/class
-                base_indent: int = len(line) - len(line.lstrip())
-                
-                # Collect all lines that belong to this function/class
-                while i < len(lines):
-                    next_line = lines[i]
-                    
-                    # If it's an empty line, include it
-                    if not next_line.strip():
-                        function_lines.append(next_line)
-                        i += 1
-                        continue
-                    
-                    # If it's indented more than the function/class, it belongs to it
-                    next_indent: int = len(next_line) - len(next_line.lstrip())
-                    if next_indent > base_indent:
-                        function_lines.append(next_line)
-                        i += 1
-                        continue
-                    
-                    # If we hit another top-level definition or unindented code, stop
-                    break
-                
-                # Add the complete function/class as a block
-                block_content = '\n'.join(function_lines).strip()
-                if block_content:
-                    blocks.append(block_content)
                 continue
-            else:
-                current_block_lines.append(line)
+            
+            # Lines since the last definition form a block of their own
+            add_block(position, i)
+            position = i
+            i += 1
+            
+            # Collect all lines that belong to this function/class. The
+            # definition starts in column 0, so every blank or indented
+            # line after it is part of it, and the first other line ends it
+            while i < line_count and _continues_block(code[offsets[i]:offsets[i + 1]]):
                 i += 1
+            
+            add_block(position, i)
+            position = i
         
         # Add any remaining lines as a block
-        if current_block_lines:
-            block_content = '\n'.join(current_block_lines).strip()
+        add_block(position, line_count)
+        return blocks
+    
+    def _split_python_with_ast(self, code: str) -> Optional[List[str]]:
+        """
+        Split Python code into logical blocks using its syntax tree.
+        
+        Top-level functions and classes (with their decorators and any
+        indented comments after the body) become one block each, and the
+        code between them is grouped into blocks of its own.
+        
+        Args:
+            code: Python code to split
+            
+        Returns:
+            List of code blocks, or None if the code does not parse (or is
+            too deeply nested to parse)
+        """
+        try:
+            # The input is only read, never run, so warnings about it (such as
+            # invalid escape sequences in strings) are not the caller's concern
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                tree = ast.parse(code)
+        except (SyntaxError, ValueError, RecursionError, MemoryError):
+            # Deeply nested expressions can exhaust the parser's stack or memory
+            return None
+        
+        offsets = _line_offsets(code)
+        line_count = len(offsets) - 1
+        blocks: List[str] = []
+        
+        def add_block(first: int, last: int) -> None:
+            block_content = code[offsets[first]:offsets[last]].strip()
             if block_content:
                 blocks.append(block_content)
         
+        position = 0
+        for node in tree.body:
+            if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                continue
+            
+            first = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list]) - 1
+            last = node.end_lineno or node.lineno
+            # Trailing comments indented under the body still belong to it
+            while last < line_count and _continues_block(code[offsets[last]:offsets[last + 1]]):
+                last += 1
+            
+            add_block(position, first)
+            add_block(first, last)
+            position = last
+        
+        add_block(position, line_count)
         return blocks